@@ -1,12 +1,25 @@
+import logging
 import time
 
+import requests
 import spotipy
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from spotipy.exceptions import SpotifyBaseException
 from spotipy.oauth2 import SpotifyClientCredentials, SpotifyOAuth
 from lrclib import LrcLibAPI
 
 from internal.secrets import CLIENT_SECRET, CLIENT_ID
 
-api = LrcLibAPI(user_agent="my-app/0.0.1")
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+lrclib_session = requests.Session()
+lrclib_session.mount("https://", HTTPAdapter(
+    # raise_on_status=False so the last response still reaches lrclib's own error mapping
+    max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504), raise_on_status=False)
+))
+api = LrcLibAPI(user_agent="my-app/0.0.1", session=lrclib_session)
 
 # todo: fine grain the scopes needed
 #https://developer.spotify.com/documentation/web-api/concepts/scopes
@@ -25,10 +38,11 @@ sp = spotipy.Spotify(auth_manager=SpotifyOAuth(
 ))
 # print(sp.currently_playing())
 current_song = sp.currently_playing()
-track_name = current_song["item"]["name"]
-album_name = current_song["item"]["album"]["name"]
-artist_name = current_song["item"]["artists"][0]["name"]
-duration = current_song["item"]["duration_ms"] // 1000
+song_info = current_song["item"]
+track_name = song_info["name"]
+album_name = song_info["album"]["name"]
+artist_name = song_info["artists"][0]["name"]
+duration = song_info["duration_ms"] // 1000
 
 lyric=api.get_lyrics(
     track_name=track_name,
@@ -40,16 +54,54 @@ lyric=api.get_lyrics(
 BUFFER_MS = 1000
 BAD_LINE_MS = 149160
 START_OF_NEW_LINE = 151950
+MAX_BACKOFF_SEC = 60
+# poll often only when close to the bad line, rarely otherwise
+MIN_POLL_MS = 200
+MAX_POLL_MS = 15000
+NO_SONG_POLL_MS = 5000
+# while paused before the bad line, never poll slower than it would take a resume to reach it,
+# and never faster than the old 1 Hz
+PAUSED_MIN_POLL_MS = 1000
 
+error_count = 0
+poll_ms = MIN_POLL_MS
 while True:
-    print("waiting for 1sec")
-    time.sleep(1)
-    current_song = sp.currently_playing()
-    duration = current_song["progress_ms"]
-    print(f"duration is {duration}")
-    if (BAD_LINE_MS - BUFFER_MS) < duration < START_OF_NEW_LINE:
-        sp.seek_track(position_ms=START_OF_NEW_LINE)
-        print("skipped!")
+    logger.debug("waiting for %dms", poll_ms)
+    time.sleep(poll_ms / 1000)
+    try:
+        current_song = sp.currently_playing()
+        if not current_song or not current_song.get("item"):
+            error_count = 0
+            poll_ms = NO_SONG_POLL_MS
+            continue
+        duration = current_song["progress_ms"]
+        logger.debug("duration is %d", duration)
+        if (BAD_LINE_MS - BUFFER_MS) < duration < START_OF_NEW_LINE:
+            sp.seek_track(position_ms=START_OF_NEW_LINE)
+            logger.info("skipped!")
+            duration = START_OF_NEW_LINE
+    except (SpotifyBaseException, requests.exceptions.RequestException) as e:
+        # back off instead of hammering the api (rate limits / outages / no active device /
+        # token refresh failures, which raise SpotifyOauthError rather than SpotifyException).
+        # spotipy already retries 429s with Retry-After itself before raising
+        poll_ms = min(MAX_BACKOFF_SEC, 2 ** error_count) * 1000
+        error_count += 1
+        logger.warning("spotify request failed (%s), retrying in %dms", e, poll_ms)
+        continue
+    error_count = 0
+
+    # progress doesn't move while paused, so the distance below would stay tiny
+    if not current_song.get("is_playing"):
+        poll_ms = NO_SONG_POLL_MS
+        if duration < START_OF_NEW_LINE:
+            poll_ms = max(PAUSED_MIN_POLL_MS, min(poll_ms, BAD_LINE_MS - BUFFER_MS - duration))
+        continue
+
+    # wake up right before the bad line or the end of the song, whichever comes first
+    next_poll_ms = current_song["item"]["duration_ms"] - duration
+    if duration <= BAD_LINE_MS - BUFFER_MS:
+        next_poll_ms = min(next_poll_ms, BAD_LINE_MS - BUFFER_MS - duration)
+    poll_ms = max(MIN_POLL_MS, min(next_poll_ms, MAX_POLL_MS))
 
 # [02:29.16] Done running, come up with Josh Dun, wanted dead or alive
 # [02:31.95]